@@ -9,18 +9,33 @@ Usage:
     python3 qrz.py <callsign>
 
 Credentials are read from ~/.qrz (JSON with "login" and "api" keys).
+The QRZ session key is cached at ~/.cache/qrz/session for
+SESSION_MAX_AGE_HOURS hours.
 """
 
 import json
-import re
+import os
 import sys
-import xml.etree.ElementTree as ET
+import time
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 QRZ_XML_URL = "https://xmldata.qrz.com/xml/current/"
 AGENT_NAME  = "qrz_cli_v1.0"
+CACHE_DIR   = Path.home() / ".cache" / "qrz"
+SESSION_CACHE = CACHE_DIR / "session"
+SESSION_MAX_AGE_HOURS = 24
+
+# Shared so the auth and lookup requests reuse one keep-alive connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
 
 # Ordered list of (xml_tag, display_label) pairs
 FIELDS = [
@@ -54,6 +69,7 @@ FIELDS = [
     ("geoloc",   "Geo Source"),
     ("attn",     "Attention"),
 ]
+FIELD_TAGS = {tag for tag, _ in FIELDS}
 
 
 # ---------------------------------------------------------------------------
@@ -74,45 +90,81 @@ def load_credentials() -> tuple[str, str]:
 
 
 # ---------------------------------------------------------------------------
-# QRZ helpers
+# QRZ session cache
 # ---------------------------------------------------------------------------
 
-def _strip_ns(xml_text: str) -> ET.Element:
-    clean = re.sub(r' xmlns[^"]*"[^"]*"', "", xml_text)
-    return ET.fromstring(clean)
+class SessionExpired(Exception):
+    """QRZ rejected the session key (timed out or invalid)."""
+
+
+def _load_cached_session(username: str) -> str | None:
+    """Return the cached session key for `username` if it is still fresh."""
+    try:
+        age_hours = (time.time() - SESSION_CACHE.stat().st_mtime) / 3600
+        if age_hours >= SESSION_MAX_AGE_HOURS:
+            return None
+        with open(SESSION_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("login") != username:
+        return None
+    return cached.get("key") or None
 
 
+def _save_cached_session(username: str, session_key: str) -> None:
+    """Write the session key to SESSION_CACHE, readable only by the user."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(SESSION_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"login": username, "key": session_key}, f)
+
+
+# ---------------------------------------------------------------------------
+# QRZ helpers
+# ---------------------------------------------------------------------------
+
 def get_session(username: str, password: str) -> str:
-    resp = requests.get(
-        f"{QRZ_XML_URL}?username={username};password={password};agent={AGENT_NAME}",
+    resp = _SESSION.get(
+        QRZ_XML_URL,
+        params={"username": username, "password": password, "agent": AGENT_NAME},
         timeout=30,
     )
     resp.raise_for_status()
-    root = _strip_ns(resp.text)
-    key = root.find(".//Key")
+    root = ET.fromstring(resp.content)
+    key = root.find(".//{*}Key")
     if key is not None:
         return key.text.strip()
-    err = root.find(".//Error")
+    err = root.find(".//{*}Error")
     sys.exit(f"QRZ auth failed: {err.text.strip() if err is not None else resp.text[:200]}")
 
 
 def lookup(session_key: str, callsign: str) -> dict[str, str]:
-    resp = requests.get(
-        f"{QRZ_XML_URL}?s={session_key};callsign={callsign}",
+    """
+    Fetch a callsign record, stream-parsing the response so only the tags
+    in FIELDS are kept and each element is released as soon as it is read.
+    """
+    data = {tag: "" for tag, _ in FIELDS}
+    with _SESSION.get(
+        QRZ_XML_URL,
+        params={"s": session_key, "callsign": callsign},
         timeout=30,
-    )
-    resp.raise_for_status()
-    root = _strip_ns(resp.text)
-
-    err = root.find(".//Error")
-    if err is not None:
-        sys.exit(f"QRZ error: {err.text.strip()}")
-
-    def text(tag: str) -> str:
-        elem = root.find(f".//{tag}")
-        return elem.text.strip() if elem is not None and elem.text else ""
-
-    return {tag: text(tag) for tag, _ in FIELDS}
+        stream=True,
+    ) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        for _, elem in ET.iterparse(resp.raw, events=("end",)):
+            tag = elem.tag.rpartition("}")[2]
+            if tag == "Error":
+                message = (elem.text or "").strip()
+                if "session" in message.lower():
+                    raise SessionExpired(message)
+                sys.exit(f"QRZ error: {message}")
+            if tag in FIELD_TAGS and elem.text:
+                data[tag] = elem.text.strip()
+            elem.clear()
+
+    return data
 
 
 # ---------------------------------------------------------------------------
@@ -154,8 +206,18 @@ def main() -> None:
     callsign = sys.argv[1].strip().upper()
 
     username, password = load_credentials()
-    session_key = get_session(username, password)
-    data = lookup(session_key, callsign)
+
+    data = None
+    session_key = _load_cached_session(username)
+    if session_key:
+        try:
+            data = lookup(session_key, callsign)
+        except SessionExpired:
+            pass
+    if data is None:
+        session_key = get_session(username, password)
+        _save_cached_session(username, session_key)
+        data = lookup(session_key, callsign)
     print_table(data)
 
 
@@ -10,21 +10,34 @@ Usage:
     python3 qrz_lookup.py <zipcode>
 
 Credentials are read from ~/.qrz  (JSON with "login" and "api" keys).
-EN.dat is cached at ~/.cache/qrz/en_dat.gz for CACHE_AGE_DAYS days.
+EN.dat is cached uncompressed at ~/.cache/qrz/en_dat for CACHE_AGE_DAYS days
+and memory-mapped when searched.  The QRZ session key is cached at
+~/.cache/qrz/session for SESSION_MAX_AGE_HOURS hours.
 """
 
 import csv
-import gzip
 import io
 import json
+import mmap
+import os
+import re
 import struct
 import sys
+import threading
 import time
-import xml.etree.ElementTree as ET
 import zlib
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 # ---------------------------------------------------------------------------
 # Constants
@@ -34,9 +47,15 @@ QRZ_XML_URL   = "https://xmldata.qrz.com/xml/current/"
 FCC_AMAT_ZIP  = "https://data.fcc.gov/download/pub/uls/complete/l_amat.zip"
 AGENT_NAME    = "qrz_zip_lookup_v1.0"
 CACHE_DIR     = Path.home() / ".cache" / "qrz"
-EN_DAT_CACHE  = CACHE_DIR / "en_dat.gz"
+EN_DAT_CACHE  = CACHE_DIR / "en_dat"
+OLD_EN_CACHE  = CACHE_DIR / "en_dat.gz"   # gzip cache used by earlier versions
 CACHE_AGE_DAYS = 7
-QRZ_DELAY     = 0.1   # seconds between QRZ lookups
+SESSION_CACHE = CACHE_DIR / "session"
+SESSION_MAX_AGE_HOURS = 24
+QRZ_DELAY     = 0.1   # minimum seconds between QRZ request starts
+QRZ_WORKERS   = 16    # concurrent QRZ lookups
+QRZ_RETRIES   = 3     # retries per request on connection errors
+RECORD_TAGS   = {"call", "zip", "u_views"}   # QRZ tags read by lookup_qrz
 
 
 # ---------------------------------------------------------------------------
@@ -68,66 +87,179 @@ def load_credentials() -> tuple[str, str]:
     return username, password
 
 
+# ---------------------------------------------------------------------------
+# QRZ session cache
+# ---------------------------------------------------------------------------
+
+class SessionExpired(Exception):
+    """QRZ rejected the session key (timed out or invalid)."""
+
+
+def _load_cached_session(username: str) -> str | None:
+    """Return the cached session key for `username` if it is still fresh."""
+    try:
+        age_hours = (time.time() - SESSION_CACHE.stat().st_mtime) / 3600
+        if age_hours >= SESSION_MAX_AGE_HOURS:
+            return None
+        with open(SESSION_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("login") != username:
+        return None
+    return cached.get("key") or None
+
+
+def _save_cached_session(username: str, session_key: str) -> None:
+    """Write the session key to SESSION_CACHE, readable only by the user."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(SESSION_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"login": username, "key": session_key}, f)
+
+
 # ---------------------------------------------------------------------------
 # QRZ XML helpers
 # ---------------------------------------------------------------------------
 
-def _strip_ns(xml_text: str) -> ET.Element:
-    """Parse XML, stripping default namespace so .find() works without prefixes."""
-    import re
-    clean = re.sub(r' xmlns[^"]*"[^"]*"', "", xml_text)
-    return ET.fromstring(clean)
+def make_http_session() -> requests.Session:
+    """
+    Build the Session shared by every FCC and QRZ request, with a keep-alive
+    pool large enough for QRZ_WORKERS and retries with exponential backoff.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=32,
+        max_retries=Retry(total=QRZ_RETRIES, backoff_factor=0.3),
+    )
+    session.mount("https://", adapter)
+    return session
 
 
-def get_qrz_session(username: str, password: str) -> str:
+def get_qrz_session(session: requests.Session, username: str, password: str) -> str:
     """Authenticate with QRZ XML API and return the session key."""
-    query = f"username={username};password={password};agent={AGENT_NAME}"
-    resp = requests.get(f"{QRZ_XML_URL}?{query}", timeout=30)
+    params = {"username": username, "password": password, "agent": AGENT_NAME}
+    resp = session.get(QRZ_XML_URL, params=params, timeout=30)
     resp.raise_for_status()
 
-    root = _strip_ns(resp.text)
-    key_elem = root.find(".//Key")
+    root = ET.fromstring(resp.content)
+    key_elem = root.find(".//{*}Key")
     if key_elem is not None:
         return key_elem.text.strip()
 
-    error_elem = root.find(".//Error")
+    error_elem = root.find(".//{*}Error")
     if error_elem is not None:
         sys.exit(f"QRZ authentication failed: {error_elem.text.strip()}")
 
     sys.exit(f"QRZ authentication failed: unexpected response\n{resp.text[:500]}")
 
 
-def lookup_qrz(session_key: str, callsign: str) -> dict | None:
+class _RateLimiter:
+    """Thread-safe limiter spacing successive calls at least `interval` apart."""
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def lookup_qrz(
+    session: requests.Session,
+    session_key: str,
+    callsign: str,
+    limiter: _RateLimiter | None = None,
+) -> dict | None:
     """
     Fetch a callsign record from QRZ.  Returns a dict with keys
-    'callsign', 'zip', 'views', or None if not found.
+    'callsign', 'zip', 'views', or None if not found.  Raises
+    SessionExpired if QRZ rejects `session_key`.
+
+    `limiter`, if given, is waited on before the request.
     """
-    query = f"s={session_key};callsign={callsign}"
+    params = {"s": session_key, "callsign": callsign}
+    if limiter is not None:
+        limiter.wait()
     try:
-        resp = requests.get(f"{QRZ_XML_URL}?{query}", timeout=30)
+        resp = session.get(QRZ_XML_URL, params=params, timeout=30)
         resp.raise_for_status()
     except requests.RequestException:
         return None
 
-    root = _strip_ns(resp.text)
-    if root.find(".//Error") is not None:
-        return None
-
-    def text(tag: str) -> str:
-        elem = root.find(f".//{tag}")
-        return elem.text.strip() if elem is not None and elem.text else ""
+    # One walk over the tree instead of a recursive .find() per tag
+    found: dict[str, str] = {}
+    for elem in ET.fromstring(resp.content).iter():
+        if not isinstance(elem.tag, str):   # lxml comments / PIs
+            continue
+        tag = elem.tag.rpartition("}")[2]
+        if tag == "Error":
+            if "session" in (elem.text or "").lower():
+                raise SessionExpired(elem.text.strip())
+            return None
+        if tag in RECORD_TAGS and elem.text:
+            found[tag] = elem.text.strip()
 
     return {
-        "callsign": text("call") or callsign,
-        "zip":      text("zip"),
-        "views":    text("u_views") or "0",
+        "callsign": found.get("call") or callsign,
+        "zip":      found.get("zip", ""),
+        "views":    found.get("u_views") or "0",
     }
 
 
+def lookup_all(
+    session: requests.Session, session_key: str, callsigns: list[str]
+) -> list[dict]:
+    """
+    Look up `callsigns` concurrently on QRZ (QRZ_WORKERS at a time, with
+    request starts spaced QRZ_DELAY apart).  Returns the records found,
+    in the order of `callsigns`.  On SessionExpired, pending lookups are cancelled
+    and the exception is re-raised.
+    """
+    limiter = _RateLimiter(QRZ_DELAY)
+    width = len(str(len(callsigns)))
+    records: list[dict] = []
+
+    with ThreadPoolExecutor(max_workers=QRZ_WORKERS) as pool:
+        futures = {
+            pool.submit(lookup_qrz, session, session_key, call, limiter): call
+            for call in callsigns
+        }
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                print(f"  [{i:>{width}}/{len(callsigns)}] {futures[future]:<10}", end="\r")
+                future.result()
+        except SessionExpired:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    # Futures are keyed in submission order, so this follows `callsigns`
+    for future in futures:
+        record = future.result()
+        if record:
+            records.append(record)
+    return records
+
+
 # ---------------------------------------------------------------------------
 # FCC bulk-ZIP range-request reader
 # ---------------------------------------------------------------------------
 
+# ZIP record layouts, compiled once
+_EOCD     = struct.Struct("<4sHHHHIIH")             # end of central directory
+_CD_ENTRY = struct.Struct("<4sHHHHHHIIIHHHHHII")    # central directory entry
+_LH_FNAME = struct.Struct("<HH")                    # local header name/extra len @26
+_LH_SLACK = 2 * 0xFFFF                              # max local name + extra length
+_CHUNK_SIZE = 1 << 16                               # streamed download chunk size
+
+
 def _range_get(session: requests.Session, url: str, start: int, end: int) -> bytes:
     """HTTP range request returning bytes start..end inclusive."""
     resp = session.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=120)
@@ -149,16 +281,12 @@ def _get_zip_entry_map(session: requests.Session, url: str) -> dict[str, tuple]:
     fetch_size = min(65557, file_size)
     tail = _range_get(session, url, file_size - fetch_size, file_size - 1)
 
-    eocd_sig = b"PK\x05\x06"
-    pos = len(tail) - 22
-    while pos >= 0:
-        if tail[pos : pos + 4] == eocd_sig:
-            break
-        pos -= 1
+    # The 22-byte EOCD record must fit before the end of the file
+    pos = tail.rfind(b"PK\x05\x06", 0, len(tail) - 18)
     if pos < 0:
         raise ValueError("ZIP EOCD signature not found")
 
-    _, _, _, _, _, cd_size, cd_offset, _ = struct.unpack_from("<4sHHHHIIH", tail, pos)
+    _, _, _, _, _, cd_size, cd_offset, _ = _EOCD.unpack_from(tail, pos)
 
     # Download central directory
     cd = _range_get(session, url, cd_offset, cd_offset + cd_size - 1)
@@ -167,61 +295,103 @@ def _get_zip_entry_map(session: requests.Session, url: str) -> dict[str, tuple]:
     cpos = 0
     cd_sig = b"PK\x01\x02"
 
-    while cpos + 46 <= len(cd):
+    while cpos + _CD_ENTRY.size <= len(cd):
         if cd[cpos : cpos + 4] != cd_sig:
             break
         (_, _, _, _, method, _, _, _, comp_size, uncomp_size,
-         fname_len, extra_len, comment_len, _, _, _, local_offset) = struct.unpack_from(
-            "<4sHHHHHHIIIHHHHHII", cd, cpos
+         fname_len, extra_len, comment_len, _, _, _, local_offset) = _CD_ENTRY.unpack_from(
+            cd, cpos
         )
-        fname = cd[cpos + 46 : cpos + 46 + fname_len].decode("utf-8", errors="replace")
+        name_start = cpos + _CD_ENTRY.size
+        fname = cd[name_start : name_start + fname_len].decode("utf-8", errors="replace")
         entries[fname] = (local_offset, comp_size, uncomp_size, method)
-        cpos += 46 + fname_len + extra_len + comment_len
+        cpos = name_start + fname_len + extra_len + comment_len
 
     return entries
 
 
-def _download_zip_entry(
+def _stream_zip_entry(
     session: requests.Session,
     url: str,
     local_offset: int,
     comp_size: int,
     method: int,
-) -> bytes:
-    """Download and decompress one entry from the remote ZIP."""
-    # Read local file header (30 bytes) to find actual data offset
-    lh = _range_get(session, url, local_offset, local_offset + 29)
-    fname_len  = struct.unpack_from("<H", lh, 26)[0]
-    extra_len  = struct.unpack_from("<H", lh, 28)[0]
-    data_start = local_offset + 30 + fname_len + extra_len
+) -> Iterator[bytes]:
+    """
+    Download one entry from the remote ZIP, yielding decompressed chunks as
+    the compressed data arrives.
 
-    comp_data = _range_get(session, url, data_start, data_start + comp_size - 1)
+    The local header and the data come from a single streamed range request.
+    Its end allows for the largest possible name and extra fields; reading
+    stops after comp_size bytes of data, so the over-read is never fetched.
+    """
+    if method not in (0, 8):    # Stored, Deflate
+        raise ValueError(f"Unsupported ZIP compression method: {method}")
+    inflater = zlib.decompressobj(-15) if method == 8 else None
 
-    if method == 0:    # Stored
-        return comp_data
-    if method == 8:    # Deflate
-        return zlib.decompress(comp_data, -15)
-    raise ValueError(f"Unsupported ZIP compression method: {method}")
+    end = local_offset + 30 + _LH_SLACK + comp_size - 1
+    headers = {"Range": f"bytes={local_offset}-{end}"}
+    with session.get(url, headers=headers, stream=True, timeout=120) as resp:
+        resp.raise_for_status()
+        header = b""
+        remaining = comp_size
+        for chunk in resp.iter_content(_CHUNK_SIZE):
+            if header is not None:
+                # Buffer until the variable-length local header is complete
+                header += chunk
+                if len(header) < 30:
+                    continue
+                data_start = 30 + sum(_LH_FNAME.unpack_from(header, 26))
+                if len(header) < data_start:
+                    continue
+                chunk, header = header[data_start:], None
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield inflater.decompress(chunk) if inflater else chunk
+            if not remaining:
+                break
+
+    if remaining:
+        raise ValueError(f"ZIP entry truncated: {remaining} bytes missing")
+    if inflater:
+        yield inflater.flush()
 
 
 # ---------------------------------------------------------------------------
 # EN.dat caching and parsing
 # ---------------------------------------------------------------------------
 
-def get_en_dat(session: requests.Session) -> bytes:
+def _map_en_dat(path: Path) -> mmap.mmap:
     """
-    Return the decompressed content of EN.dat from the FCC amateur radio ZIP.
-    Uses a local gzip cache (CACHE_AGE_DAYS); only EN.dat is downloaded
-    (not the entire 173 MB ZIP file).
+    Memory-map the cached EN.dat read-only, asking the kernel to start
+    reading it in ahead of the scan where the platform supports it.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        mm.madvise(mmap.MADV_WILLNEED)
+    return mm
+
+
+def get_en_dat(session: requests.Session) -> mmap.mmap:
+    """
+    Return EN.dat from the FCC amateur radio ZIP as a read-only memory map.
+    Uses a local uncompressed cache (CACHE_AGE_DAYS); only EN.dat is
+    downloaded (not the entire 173 MB ZIP file).
     """
     CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    OLD_EN_CACHE.unlink(missing_ok=True)
 
     if EN_DAT_CACHE.exists():
-        age_days = (time.time() - EN_DAT_CACHE.stat().st_mtime) / 86400
-        if age_days < CACHE_AGE_DAYS:
-            with gzip.open(EN_DAT_CACHE, "rb") as f:
-                return f.read()
-        print(f"Cache is {age_days:.0f} days old — refreshing FCC data…")
+        st = EN_DAT_CACHE.stat()
+        age_days = (time.time() - st.st_mtime) / 86400
+        if age_days < CACHE_AGE_DAYS and st.st_size:
+            return _map_en_dat(EN_DAT_CACHE)
+        if st.st_size:
+            print(f"Cache is {age_days:.0f} days old — refreshing FCC data…")
 
     print("Reading FCC ZIP central directory…")
     entries = _get_zip_entry_map(session, FCC_AMAT_ZIP)
@@ -239,40 +409,68 @@ def get_en_dat(session: requests.Session) -> bytes:
         f"{uncomp_size / 1_048_576:.1f} MB uncompressed)…"
     )
 
-    data = _download_zip_entry(session, FCC_AMAT_ZIP, local_offset, comp_size, method)
-
-    with gzip.open(EN_DAT_CACHE, "wb") as f:
-        f.write(data)
+    # Inflate straight into a temp file as the download streams in, then
+    # rename so a crash never leaves a partial cache
+    tmp_path = EN_DAT_CACHE.with_suffix(".tmp")
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in _stream_zip_entry(
+                session, FCC_AMAT_ZIP, local_offset, comp_size, method
+            ):
+                f.write(chunk)
+                size += len(chunk)
+    except (requests.RequestException, ValueError, zlib.error) as exc:
+        tmp_path.unlink(missing_ok=True)
+        sys.exit(f"Error: EN.dat download failed: {exc}")
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if size != uncomp_size:
+        tmp_path.unlink()
+        sys.exit(f"Error: EN.dat download is {size} bytes, expected {uncomp_size}")
+    os.replace(tmp_path, EN_DAT_CACHE)
     print("FCC data cached.")
-    return data
+    return _map_en_dat(EN_DAT_CACHE)
 
 
-def get_callsigns_by_zip(zipcode: str, en_dat: bytes) -> list[str]:
+def get_callsigns_by_zip(zipcode: str, en_dat: mmap.mmap) -> list[str]:
     """
-    Parse EN.dat and return callsigns whose zip code starts with `zipcode`.
+    Scan EN.dat and return the unique callsigns, sorted, whose zip code
+    starts with `zipcode`.
 
     EN.dat is pipe-delimited:
       field 0  = record type (EN)
       field 4  = call sign
       field 18 = zip code
-    """
-    target = zipcode[:5]
-    callsigns: list[str] = []
-    seen: set[str] = set()
 
-    for line in en_dat.decode("latin-1").splitlines():
-        if not line.startswith("EN|"):
-            continue
-        parts = line.split("|")
-        if len(parts) <= 18:
+    Rather than visiting every record, the buffer is searched in place for
+    "|<zip>" with a single C-level find(); each hit is then checked with a
+    per-zip compiled pattern anchored at its line start, which both confirms
+    the zip is field 18 of an EN record and captures the callsign.
+    """
+    target = zipcode[:5].encode()
+    needle = b"|" + target
+    record = re.compile(
+        rb"EN\|(?:[^|\n]*\|){3}([^|\n]*)\|(?:[^|\n]*\|){13}" + re.escape(target)
+    )
+    callsigns: set[str] = set()
+
+    pos = en_dat.find(needle)
+    while pos != -1:
+        line = en_dat.rfind(b"\n", 0, pos) + 1
+        m = record.match(en_dat, line)
+        if not m:
+            pos = en_dat.find(needle, pos + 1)
             continue
-        call = parts[4].strip().upper()
-        zip5 = parts[18].strip()[:5]
-        if call and zip5 == target and call not in seen:
-            seen.add(call)
-            callsigns.append(call)
+        call = m.group(1).strip().upper().decode("latin-1")
+        if call:
+            callsigns.add(call)
+        # Resume after this line; m.end() can precede a later hit on it
+        eol = en_dat.find(b"\n", m.end())
+        pos = -1 if eol == -1 else en_dat.find(needle, eol)
 
-    return callsigns
+    return sorted(callsigns)
 
 
 # ---------------------------------------------------------------------------
@@ -286,14 +484,19 @@ def main() -> None:
     zipcode = sys.argv[1].strip()
     output_file = f"ham_operators_{zipcode}.csv"
 
-    session = requests.Session()
+    session = make_http_session()
 
     print("Loading credentials from ~/.qrz …")
     username, password = load_credentials()
 
-    print("Authenticating with QRZ.com …")
-    session_key = get_qrz_session(username, password)
-    print("Session established.")
+    session_key = _load_cached_session(username)
+    if session_key:
+        print("Using cached QRZ session.")
+    else:
+        print("Authenticating with QRZ.com …")
+        session_key = get_qrz_session(session, username, password)
+        _save_cached_session(username, session_key)
+        print("Session established.")
 
     en_dat = get_en_dat(session)
 
@@ -305,20 +508,19 @@ def main() -> None:
     print(f"Found {len(callsigns)} operator(s).")
 
     print("Looking up QRZ profiles …")
-    width = len(str(len(callsigns)))
-    rows: list[tuple[str, str]] = []
-    seen_calls: set[str] = set()
-    for i, callsign in enumerate(callsigns, 1):
-        print(f"  [{i:>{width}}/{len(callsigns)}] {callsign:<10}", end="\r")
-        record = lookup_qrz(session_key, callsign)
-        if record:
-            call = record["callsign"]
-            if call not in seen_calls:
-                seen_calls.add(call)
-                rows.append((call, record["views"]))
-        time.sleep(QRZ_DELAY)
-
-    rows.sort(key=lambda r: int(r[1]), reverse=True)
+    try:
+        records = lookup_all(session, session_key, callsigns)
+    except SessionExpired:
+        print("\nQRZ session expired — re-authenticating …")
+        session_key = get_qrz_session(session, username, password)
+        _save_cached_session(username, session_key)
+        records = lookup_all(session, session_key, callsigns)
+    # Keyed by QRZ's callsign, which can collapse several FCC calls into one;
+    # the first record in FCC order wins, as before
+    views: dict[str, str] = {}
+    for r in records:
+        views.setdefault(r["callsign"], r["views"])
+    rows = sorted(views.items(), key=lambda r: (-int(r[1]), r[0]))
 
     if Path(output_file).exists():
         Path(output_file).unlink()